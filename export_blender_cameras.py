@@ -1,7 +1,21 @@
 import bpy
 import json
 import os
-import mathutils
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # Blender's bundled Python does not ship orjson
+    orjson = None
+
+def dumps_json(data) -> bytes:
+    """
+    Serializes data to JSON bytes, using orjson when available.
+    numpy arrays are written as nested lists either way.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, indent=4, default=lambda o: o.tolist()).encode()
 
 def export_cameras():
     """
@@ -21,41 +35,40 @@ def export_cameras():
             
     output_path = os.path.join(base_dir, "cameras.json")
     
-    cameras_data = {}
+    # Collect cameras once so the world matrices can be copied into a
+    # single preallocated buffer instead of indexing each element.
+    cameras = [obj for obj in bpy.context.scene.objects if obj.type == 'CAMERA']
     
-    # Iterate through all objects
-    for obj in bpy.context.scene.objects:
-        if obj.type == 'CAMERA':
-            # Get the matrix_world
-            # This is the transform from Local-Camera space to World space.
-            mw = obj.matrix_world
-            
-            # Convert to list of lists for JSON
-            mat_list = [
-                [mw[0][0], mw[0][1], mw[0][2], mw[0][3]],
-                [mw[1][0], mw[1][1], mw[1][2], mw[1][3]],
-                [mw[2][0], mw[2][1], mw[2][2], mw[2][3]],
-                [mw[3][0], mw[3][1], mw[3][2], mw[3][3]]
-            ]
-            
-            # We use the object name as the key. 
-            cameras_data[obj.name] = {
-                "matrix_world": mat_list,
-                "location": [mw[0][3], mw[1][3], mw[2][3]],
-                # Lens info could be useful
-                "lens": obj.data.lens,
-                "sensor_width": obj.data.sensor_width,
-                "sensor_height": obj.data.sensor_height
-            }
+    # matrix_world is the transform from Local-Camera space to World space.
+    # Blender stores it as float32, so nothing is lost here.
+    matrices = np.empty((len(cameras), 4, 4), dtype=np.float32)
+    for i, obj in enumerate(cameras):
+        matrices[i] = obj.matrix_world
+    # orjson only serializes C-contiguous arrays, so copy the translation column out
+    locations = np.ascontiguousarray(matrices[:, :3, 3])
+    
+    # We use the object name as the key. 
+    cameras_data = {
+        obj.name: {
+            "matrix_world": mw,
+            "location": loc,
+            # Lens info could be useful
+            "lens": obj.data.lens,
+            "sensor_width": obj.data.sensor_width,
+            "sensor_height": obj.data.sensor_height
+        }
+        for obj, mw, loc in zip(cameras, matrices, locations)
+    }
             
-    with open(output_path, 'w') as f:
-        json.dump(cameras_data, f, indent=4)
+    with open(output_path, 'wb') as f:
+        f.write(dumps_json(cameras_data))
         
     print(f"Exported {len(cameras_data)} cameras to {output_path}")
     
-    # Show a popup in Blender
+    # Show a popup in Blender. draw runs on every redraw, so format the text once.
+    popup_text = f"Exported to {output_path}"
     def draw(self, context):
-        self.layout.label(text=f"Exported to {output_path}")
+        self.layout.label(text=popup_text)
     bpy.context.window_manager.popup_menu(draw, title="Export Successful", icon='INFO')
 
 if __name__ == "__main__":
@@ -7,26 +7,68 @@ each containing a 'cameras.json' file and subfolders for each camera (Camera0, C
 import argparse
 import json
 import logging
+import math
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import pycolmap
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def loads_json(data: bytes):
+    """
+    Parses JSON bytes, using orjson when available.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def load_blender_export(json_path: Path) -> Tuple[Dict[str, np.ndarray], Dict[str, Tuple[float, float, float]]]:
+    """
+    Loads camera poses and lens data from Blender export.
+    Returns (dict: camera_name -> 4x4 matrix_world,
+             dict: camera_name -> (lens, sensor_width, sensor_height), all in mm)
+    Cameras without lens data are left out of the second dict.
+    """
+    cameras = {}
+    intrinsics = {}
+    with open(json_path, 'rb') as f:
+        data = loads_json(f.read())
+    
+    for name, cam_data in data.items():
+        cameras[name] = np.asarray(cam_data["matrix_world"], dtype=np.float64).reshape(4, 4)
+        # Lens data is optional; only --blender_intrinsics uses it
+        lens = (cam_data.get("lens"), cam_data.get("sensor_width"), cam_data.get("sensor_height"))
+        if None not in lens:
+            intrinsics[name] = lens
+    return cameras, intrinsics
+
 def load_blender_cameras(json_path: Path) -> Dict[str, np.ndarray]:
     """
     Loads camera poses from Blender export.
     Returns dict: camera_name -> 4x4 matrix_world
     """
-    with open(json_path, 'r') as f:
-        data = json.load(f)
-    
-    cameras = {}
-    for name, cam_data in data.items():
-        mat = np.array(cam_data["matrix_world"])
-        cameras[name] = mat
-    return cameras
+    return load_blender_export(json_path)[0]
+
+def pinhole_params(lens: float, sensor_width: float, width: int, height: int) -> str:
+    """
+    Converts Blender lens data to COLMAP PINHOLE params "fx,fy,cx,cy" in pixels.
+    Assumes Blender's default sensor fit (Auto), where sensor_width spans the
+    longer side of the image.
+    """
+    focal = lens / sensor_width * max(width, height)
+    return f"{focal},{focal},{width / 2},{height / 2}"
+
+# Blender camera axes (Right, Up, Back) -> COLMAP camera axes (Right, Down, Forward).
+# It is its own inverse.
+_B2C = np.diag([1, -1, -1, 1]).astype(np.float64)
+_B2C.flags.writeable = False
 
 def blender_to_colmap_matrix():
     """
@@ -36,55 +78,106 @@ def blender_to_colmap_matrix():
     COLMAP: X Right, Y Down, +Z View
     
     Transformation: Flip Y and Z axes.
+    The returned array is shared and read-only.
     """
-    return np.diag([1, -1, -1, 1])
+    return _B2C
 
-def compute_rig_config(
-    folder_path: Path, 
+def to_colmap(M: np.ndarray) -> np.ndarray:
+    """
+    Equivalent to M @ blender_to_colmap_matrix(), which just negates the
+    Y and Z columns. Works on a single 4x4 matrix or an (N, 4, 4) stack.
+    """
+    out = np.array(M, dtype=np.float64)
+    out[..., :, 1:3] *= -1
+    return out
+
+def compute_rig_poses(
     blender_cameras: Dict[str, np.ndarray],
     ref_camera_name: str = "Camera0"
-) -> Optional[pycolmap.RigConfig]:
+) -> Tuple[Optional[str], List[str], np.ndarray, List[str]]:
     """
-    Creates a RigConfig for the given folder based on Blender poses.
+    Computes the cam_from_rig transform of every camera from Blender poses.
+    Returns (ref_camera_name, camera_names, T_c_r, discarded) with the reference first,
+    where T_c_r is an (N, 4, 4) stack and discarded lists cameras dropped for
+    non-finite poses. ref_camera_name is None when no camera is usable.
+    Plain numpy and no logging, so it can run in a worker process.
     """
-    if ref_camera_name not in blender_cameras:
-        if not blender_cameras:
-            return None
-        ref_camera_name = list(blender_cameras.keys())[0]
-        
-    logging.info(f"Creating RigConfig for {folder_path.name} using ref {ref_camera_name}")
+    if not blender_cameras:
+        return None, [], np.empty((0, 4, 4)), []
     
-    B2C = blender_to_colmap_matrix()
+    cam_names = list(blender_cameras.keys())
+    M = np.stack([blender_cameras[n] for n in cam_names])
     
-    M_ref_w = blender_cameras[ref_camera_name] @ B2C
+    # Drop poses with inf/nan (e.g. from broken Blender drivers) in one pass
+    discarded = []
+    finite = np.isfinite(M).reshape(len(M), -1).all(axis=1)
+    if not finite.all():
+        discarded = [n for n, ok in zip(cam_names, finite) if not ok]
+        cam_names = [n for n, ok in zip(cam_names, finite) if ok]
+        M = M[finite]
+        if not cam_names:
+            return None, [], np.empty((0, 4, 4)), discarded
     
-    rig_cameras = []
+    if ref_camera_name not in cam_names:
+        ref_camera_name = cam_names[0]
+    
+    if len(cam_names) == 1:
+        # Mono setup: the only camera is the rig origin, nothing to solve
+        return ref_camera_name, cam_names, np.eye(4)[np.newaxis], discarded
     
     # Reference sensor MUST be added first — pycolmap enforces this.
     # Sort so ref comes first, then the rest alphabetically.
-    sorted_cam_names = sorted(
-        blender_cameras.keys(),
-        key=lambda n: (n != ref_camera_name, n)
+    order = sorted(
+        range(len(cam_names)),
+        key=lambda i: (cam_names[i] != ref_camera_name, cam_names[i])
     )
+    sorted_cam_names = [cam_names[i] for i in order]
+    
+    # Convert all poses in one go: (N, 4, 4) cam-to-world, ref at index 0
+    M_w = to_colmap(M[order])
+    M_ref_w = M_w[0]
+    T_c_r_all = np.linalg.inv(M_w) @ M_ref_w
+    
+    return ref_camera_name, sorted_cam_names, T_c_r_all, discarded
+
+def rig_config_from_poses(
+    folder_path: Path,
+    ref_camera_name: Optional[str],
+    cam_names: List[str],
+    T_c_r_all: np.ndarray,
+    discarded: Optional[List[str]] = None
+) -> Optional[pycolmap.RigConfig]:
+    """
+    Builds the RigConfig for the given folder from compute_rig_poses output.
+    Returns None if no camera is usable.
+    """
+    if discarded:
+        logging.warning(f"Discarding cameras with non-finite matrix_world in {folder_path.name}: {', '.join(discarded)}")
+    if not cam_names:
+        return None
     
-    for cam_name in sorted_cam_names:
+    logging.info(f"Creating RigConfig for {folder_path.name} using ref {ref_camera_name}")
+    
+    rig_cameras = []
+    # The distance/angle summary is only for the log, skip the math when it is filtered out
+    log_poses = logging.getLogger().isEnabledFor(logging.INFO)
+    
+    for cam_name, T_c_r in zip(cam_names, T_c_r_all):
         prefix = f"{folder_path.name}/{cam_name}/"
         
         if cam_name == ref_camera_name:
             cam_from_rig = None  # Identity — this is the rig origin
         else:
-            M_cam_w = blender_cameras[cam_name] @ B2C
-            T_c_r = np.linalg.inv(M_cam_w) @ M_ref_w
-            
             R = T_c_r[:3, :3]
             t = T_c_r[:3, 3]
             
-            cam_from_rig = pycolmap.Rigid3d(pycolmap.Rotation3d(R), t)
+            cam_from_rig = pycolmap.Rigid3d(pycolmap.Rotation3d(np.ascontiguousarray(R)), t)
             
-            distance = np.linalg.norm(t)
-            cos_angle = np.clip((np.trace(R) - 1) / 2, -1.0, 1.0)
-            angle_deg = np.rad2deg(np.arccos(cos_angle))
-            logging.info(f"  {cam_name} → {ref_camera_name}: distance={distance:.3f}m, rotation={angle_deg:.1f}°")
+            if log_poses:
+                distance = math.hypot(*t)
+                cos_angle = min(max((float(np.trace(R)) - 1) / 2, -1.0), 1.0)
+                angle_deg = math.degrees(math.acos(cos_angle))
+                logging.info(f"  {cam_name} → {ref_camera_name}: distance={distance:.3f}m, rotation={angle_deg:.1f}°")
             
         rig_cameras.append(
             pycolmap.RigConfigCamera(
@@ -96,10 +189,80 @@ def compute_rig_config(
         
     return pycolmap.RigConfig(cameras=rig_cameras)
 
+def compute_rig_config(
+    folder_path: Path, 
+    blender_cameras: Dict[str, np.ndarray],
+    ref_camera_name: str = "Camera0"
+) -> Optional[pycolmap.RigConfig]:
+    """
+    Creates a RigConfig for the given folder based on Blender poses.
+    """
+    return rig_config_from_poses(folder_path, *compute_rig_poses(blender_cameras, ref_camera_name))
+
+def load_rig(subdir: Path) -> Tuple[Tuple[Optional[str], List[str], np.ndarray, List[str]], Dict[str, Tuple[float, float, float]]]:
+    """
+    Worker for run(): loads subdir/cameras.json once and returns its rig poses
+    together with the lens data. Kept at module level so ProcessPoolExecutor can pickle it.
+    """
+    blender_cameras, intrinsics = load_blender_export(subdir / "cameras.json")
+    return compute_rig_poses(blender_cameras), intrinsics
+
+# Below this many rig folders, starting worker processes costs more than
+# parsing the (few KB) cameras.json files serially.
+PARALLEL_LOAD_MIN_RIGS = 16
+
+def list_images(folder: Path) -> List[str]:
+    """
+    Lists every file below folder, relative to it, the same way COLMAP's
+    image reader does: recursive, no extension filter, sorted.
+    """
+    names = []
+    for root, _, files in os.walk(folder):
+        rel_root = Path(root).relative_to(folder)
+        names.extend((rel_root / name).as_posix() for name in files)
+    return sorted(names)
+
+def group_images_by_intrinsics(
+    rig_intrinsics: List[Tuple[Path, Dict[str, Tuple[float, float, float]]]]
+) -> Dict[str, List[str]]:
+    """
+    Groups the images of every rig camera folder by their Blender-derived
+    PINHOLE params. Only the first readable image of each folder is read for its size.
+    Cameras without lens data in cameras.json are skipped and keep EXIF intrinsics.
+    Returns dict: params string -> image names relative to the input path
+    """
+    groups = {}
+    for subdir, intrinsics in rig_intrinsics:
+        for cam_name, (lens, sensor_width, _) in intrinsics.items():
+            cam_dir = subdir / cam_name
+            if not cam_dir.is_dir():
+                continue
+            files = list_images(cam_dir)
+            if not files:
+                continue
+            
+            # Non-image files are skipped by COLMAP too, so look for the first one that decodes
+            bitmap = None
+            for name in files:
+                bitmap = pycolmap.Bitmap.read(str(cam_dir / name), False)
+                if bitmap is not None:
+                    break
+            if bitmap is None:
+                logging.warning(f"No readable image in {cam_dir}, using EXIF intrinsics for this folder.")
+                continue
+                
+            params = pinhole_params(lens, sensor_width, bitmap.width, bitmap.height)
+            groups.setdefault(params, []).extend(f"{subdir.name}/{cam_name}/{name}" for name in files)
+    return groups
+
 def run(args):
     input_path = args.input_path
     output_path = args.output_path
     matching = args.matching
+    num_workers = args.num_workers
+    device = getattr(pycolmap.Device, args.device)
+    blender_intrinsics = args.blender_intrinsics
+    vocab_tree_path = args.vocab_tree_path
     
     database_path = output_path / "database.db"
     output_path.mkdir(exist_ok=True, parents=True)
@@ -109,17 +272,29 @@ def run(args):
         
     rig_configs = []
     
-    subdirs = [p for p in input_path.iterdir() if p.is_dir()]
+    # DirEntry carries the file type from readdir, so no extra stat per entry
+    with os.scandir(input_path) as entries:
+        subdirs = [Path(e.path) for e in entries if e.is_dir()]
     logging.info(f"Found {len(subdirs)} subdirectories in {input_path}")
     
+    rig_dirs = []
     for subdir in subdirs:
         json_path = subdir / "cameras.json"
         if not json_path.exists():
             logging.warning(f"No cameras.json found in {subdir}, skipping rig config for this folder.")
             continue
-            
-        blender_cameras = load_blender_cameras(json_path)
-        rig_config = compute_rig_config(subdir, blender_cameras)
+        rig_dirs.append(subdir)
+    
+    # Folders are independent, so parse and solve them in parallel.
+    # RigConfig objects are built here since pycolmap types may not pickle.
+    if len(rig_dirs) >= PARALLEL_LOAD_MIN_RIGS and num_workers != 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            rigs = list(executor.map(load_rig, rig_dirs))
+    else:
+        rigs = [load_rig(subdir) for subdir in rig_dirs]
+    
+    for subdir, (poses, _) in zip(rig_dirs, rigs):
+        rig_config = rig_config_from_poses(subdir, *poses)
         if rig_config:
             rig_configs.append(rig_config)
             
@@ -133,11 +308,32 @@ def run(args):
     #reader_options = pycolmap.ImageReaderOptions()
     #reader_options.camera_model = "PINHOLE"
 
+    if blender_intrinsics:
+        # Cameras get their intrinsics from cameras.json instead of EXIF.
+        # PER_FOLDER still gives every rig slot its own camera.
+        for params, image_names in group_images_by_intrinsics(
+            [(subdir, intrinsics) for subdir, (_, intrinsics) in zip(rig_dirs, rigs)]
+        ).items():
+            reader_options = pycolmap.ImageReaderOptions()
+            reader_options.camera_model = "PINHOLE"
+            reader_options.camera_params = params
+            
+            pycolmap.extract_features(
+                database_path,
+                input_path,
+                image_names=image_names,
+                camera_mode=pycolmap.CameraMode.PER_FOLDER,
+                reader_options=reader_options,
+                device=device,
+            )
+
+    # Images already in the database (from the loop above) are skipped
     pycolmap.extract_features(
         database_path, 
         input_path, 
-        camera_mode=pycolmap.CameraMode.PER_FOLDER
-        #reader_options=reader_options
+        camera_mode=pycolmap.CameraMode.PER_FOLDER,
+        #reader_options=reader_options,
+        device=device,
     )
     
     if rig_configs:
@@ -147,11 +343,10 @@ def run(args):
 
 
     # Shared across all strategies
-    def base_matching_options(use_gpu=False):
+    def base_matching_options():
         opts = pycolmap.FeatureMatchingOptions()
         opts.rig_verification = True
         opts.skip_image_pairs_in_same_frame = True
-        opts.use_gpu = use_gpu
         opts.guided_matching = True          # uses known rig geometry to guide SIFT — big help for interiors
         opts.sift.max_ratio = 0.75           # tighter than default 0.8 — reduces false matches on repetitive textures
         opts.sift.cross_check = True         # already default, but explicit is good
@@ -175,12 +370,15 @@ def run(args):
         pairing.num_nearest_neighbors = 5    # top-5 retrieved images to verify; default is fine
         pairing.num_checks = 64              # FAISS probe depth; increase to 128 if recall is poor
         pairing.num_images_after_verification = 10  # keep top-10 after geometric verification
+        if vocab_tree_path:
+            pairing.vocab_tree_path = str(vocab_tree_path)
 
         pycolmap.match_vocabtree(
             database_path,
             matching_options=base_matching_options(),
             pairing_options=pairing,
             verification_options=base_verification_options(),
+            device=device,
         )
 
     elif matching == "sequential":
@@ -195,20 +393,24 @@ def run(args):
         pairing.loop_detection_num_images = 8   # retrieve top-8 candidates; keep low for repetitive interiors
         pairing.loop_detection_num_nearest_neighbors = 1
         pairing.loop_detection_num_images_after_verification = 5
+        if vocab_tree_path:
+            pairing.vocab_tree_path = str(vocab_tree_path)
 
         pycolmap.match_sequential(
             database_path,
             matching_options=base_matching_options(),
             pairing_options=pairing,
             verification_options=base_verification_options(),
+            device=device,
         )
 
     elif matching == "exhaustive":
         logging.info("Matching features (Exhaustive)...")
         pycolmap.match_exhaustive(
             database_path,
-            matching_options=base_matching_options(use_gpu=True),
+            matching_options=base_matching_options(),
             verification_options=base_verification_options(),
+            device=device,
         )
     rec_path = output_path / "sparse"
     rec_path.mkdir(exist_ok=True, parents=True)
@@ -226,11 +428,24 @@ def run(args):
         
     logging.info("Done.")
 
+def positive_int(value: str) -> int:
+    """
+    argparse type for counts that must be at least 1.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_path", type=Path, required=True, help="Parent folder containing subdirs with cameras.json")
     parser.add_argument("--output_path", type=Path, required=True, help="Output folder for database and sparse reconstruction")
-    parser.add_argument("--matching", type=str, default="vocabtree", required=False, help="Matching method (vocabtree (default), sequential or exhaustive)")
+    parser.add_argument("--matching", type=str, default="vocabtree", choices=["vocabtree", "sequential", "exhaustive"], required=False, help="Matching method (vocabtree (default), sequential or exhaustive). Use sequential when the rig positions were captured in traversal order")
+    parser.add_argument("--num_workers", type=positive_int, default=None, required=False, help=f"Processes used to load the cameras.json files once there are at least {PARALLEL_LOAD_MIN_RIGS} rig folders (default: one per CPU)")
+    parser.add_argument("--device", type=str, default="auto", choices=["auto", "cpu", "cuda"], required=False, help="Device for SIFT extraction and matching (auto picks CUDA when pycolmap was built with it)")
+    parser.add_argument("--blender_intrinsics", action="store_true", help="Use PINHOLE cameras built from the lens data in cameras.json instead of reading intrinsics from EXIF")
+    parser.add_argument("--vocab_tree_path", type=Path, default=None, required=False, help="Local vocab tree file for vocabtree matching and sequential loop detection (default: COLMAP downloads it once into its cache)")
     args = parser.parse_args()
     
     logging.basicConfig(level=logging.INFO, format="[COLMAP] %(message)s")